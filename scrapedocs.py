@@ -17,14 +17,29 @@ import warnings
 warnings.filterwarnings("ignore", message="urllib3 v2 only supports OpenSSL")
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 import argparse
 import html2text
 import os
-from urllib.parse import urljoin, urlparse
+import shutil
+import threading
+import queue
+from urllib.parse import urljoin, urlparse, urlsplit, urlunsplit
 import time
 import re
 import hashlib
+import math
+
+try:
+    # Optional: BLAKE3 is faster than hashlib for the short image URLs we hash
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
 
 # --- Configuration ---
 BASE_URL = "https://docs.sl.antimatter.io/"
@@ -34,6 +49,12 @@ OUTPUT_FILE = f"scrapedocs_{timestamp}.md"
 IMAGES_DIR = "images"
 TIMEOUT = 15
 DELAY = 0.5
+CONCURRENCY = 16
+CONCURRENCY_PER_HOST = 8
+IMAGE_WORKERS = 8
+BLOOM_CAPACITY = 1_000_000
+BLOOM_ERROR_RATE = 0.001
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 
 # IMPORTANT: This selector tells the script which part of the HTML to convert to Markdown.
 # Modern documentation sites often wrap the main content in a <main> tag or a specific class.
@@ -42,9 +63,30 @@ DELAY = 0.5
 # Common alternatives: 'article', 'div.doc-content', 'div#main-content'
 CONTENT_SELECTOR = "main" 
 
+# Links with these extensions are not HTML pages and are never crawled
+NON_PAGE_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.gif', '.css', '.js', '.xml', '.rss', '.pdf', '.zip'})
+UNSAFE_EXT_RE = re.compile(r'[^a-zA-Z0-9.]')
+SLUG_RE = re.compile(r'[^\w\s-]')
+
 # --- Setup ---
 session = requests.Session()
+session.headers.update({'User-Agent': USER_AGENT})
+# Keep connections to the image hosts alive and retry transient failures
+adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.3))
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS)
+# Downloaded images waiting to be written to disk by image_writer()
+image_write_queue = queue.Queue(maxsize=128)
+# Local path for every image URL seen so far, and the filenames already in the images
+# directory; pages are processed in parallel, so both are guarded by the lock
+image_paths = {}
+existing_images = set()
+image_paths_lock = threading.Lock()
+BASE_NETLOC = urlsplit(BASE_URL).netloc
 visited_urls = set()
+host_next_request = {}
+host_semaphores = {}
 urls_to_visit = [BASE_URL]
 
 def is_valid(url):
@@ -52,25 +94,156 @@ def is_valid(url):
     parsed = urlparse(url)
     return bool(parsed.netloc) and bool(parsed.scheme)
 
+def canonicalize(url):
+    """Strips the query string and fragment (like #section-anchor) from 'url'."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, '', ''))
+
+def url_key(url):
+    """Returns a compact 16-byte key for 'url', so visited_urls stays small on large sites."""
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+
+class BloomFilter:
+    """Fixed-size, set-like store for url_key() digests.
+
+    Uses a couple of MB no matter how many URLs are added, at the cost of occasionally
+    reporting an unseen URL as already visited (so that page is skipped).
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Derive every bit position from the two halves of the digest (double hashing)
+        h1 = int.from_bytes(key[:8], 'little')
+        h2 = int.from_bytes(key[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
 def is_internal_link(url):
     """Checks if the URL is part of the same domain and is a documentation path."""
+    parts = urlsplit(url)
+
     # 1. Check if the domain matches the base URL
-    if urlparse(url).netloc != urlparse(BASE_URL).netloc:
+    if parts.netloc != BASE_NETLOC:
         return False
         
-    path = urlparse(url).path
+    path = parts.path
     
     # 2. Filter out common file extensions that are not HTML pages
-    if path.endswith(('.png', '.jpg', '.jpeg', '.gif', '.css', '.js', '.xml', '.rss', '.pdf', '.zip')):
+    if os.path.splitext(path)[1].lower() in NON_PAGE_EXTENSIONS:
         return False
         
     return True
 
-def get_markdown_content(url, html_content):
-    """Extracts main content and converts to markdown string."""
+def image_writer():
+    """Writes queued images to disk so downloads never wait on the filesystem."""
+    while True:
+        img_fs_path, data = image_write_queue.get()
+        try:
+            with open(img_fs_path, 'wb') as f:
+                f.write(data)
+            with image_paths_lock:
+                existing_images.add(os.path.basename(img_fs_path))
+        except OSError as e:
+            print(f"Error writing image {img_fs_path}: {e}")
+        finally:
+            image_write_queue.task_done()
+
+def download_image(img_url, img_fs_path):
+    """Downloads a single image and queues it to be written to 'img_fs_path'.
+
+    Returns True if the image was downloaded.
+    """
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
+        print(f"Downloading image: {img_url}")
+        r = session.get(img_url, timeout=TIMEOUT)
+        if r.status_code == 200:
+            image_write_queue.put((img_fs_path, r.content))
+            return True
+    except Exception as e:
+        print(f"Error downloading image {img_url}: {e}")
+    return False
+
+def image_hash(img_url):
+    """Returns a short hex digest of 'img_url' to use as the image filename."""
+    data = img_url.encode('utf-8')
+    if blake3 is not None:
+        return blake3(data).hexdigest(8)
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+def localize_images(url, content_element):
+    """Downloads the images in 'content_element' and points their src at the local copies."""
+    images_fs_path = os.path.join(OUTPUT_DIR, IMAGES_DIR)
+
+    # Work out the local path for every image before downloading any of them
+    images = []
+    downloads = {}
+    for img in content_element.find_all('img', src=True):
+        img_url = urljoin(url, img['src'])
+
+        # Images shared between pages (logos, icons) only need handling once
+        with image_paths_lock:
+            img_rel_path = image_paths.get(img_url)
+        if img_rel_path:
+            images.append((img, img_rel_path))
+            continue
         
+        # Generate unique filename based on hash of URL
+        img_hash = image_hash(img_url)
+        path_parts = os.path.splitext(urlparse(img_url).path)
+        ext = path_parts[1] if path_parts[1] else ".png"
+        # Sanitize extension
+        ext = UNSAFE_EXT_RE.sub('', ext)
+        img_filename = f"{img_hash}{ext}"
+        img_fs_path = os.path.join(images_fs_path, img_filename)
+        img_rel_path = os.path.join(IMAGES_DIR, img_filename)
+
+        # Another page may have claimed the same image in the meantime
+        with image_paths_lock:
+            is_new = img_url not in image_paths
+            image_paths[img_url] = img_rel_path
+            is_present = img_filename in existing_images
+
+        # Download image if not already present
+        if is_new and not is_present:
+            downloads[img_fs_path] = img_url
+        images.append((img, img_rel_path))
+
+    # Download the missing images in parallel
+    results = image_executor.map(download_image, downloads.values(), downloads.keys())
+
+    # Forget images that failed, so a later page that uses them tries again
+    failed = [img_url for img_url, ok in zip(downloads.values(), results) if not ok]
+    if failed:
+        with image_paths_lock:
+            for img_url in failed:
+                image_paths.pop(img_url, None)
+
+    # Update src to point to local file
+    for img, img_rel_path in images:
+        img['src'] = img_rel_path
+
+def get_markdown_content(url, soup, page_url=None):
+    """Extracts main content from a parsed page and converts to markdown string.
+
+    'page_url' is where the page was actually served from after any redirects; relative
+    image paths are resolved against it. Defaults to 'url'.
+    """
+    try:
         # 1. Attempt to find the specified content area
         content_element = soup.select_one(CONTENT_SELECTOR)
         
@@ -82,43 +255,7 @@ def get_markdown_content(url, html_content):
                  print(f"Error: Could not find any content element for {url}.")
                  return
         
-        # Resolve all relative links to absolute URLs (so they work in the offline doc)
-        for a in content_element.find_all('a', href=True):
-            a['href'] = urljoin(url, a['href'])
-
-        images_fs_path = os.path.join(OUTPUT_DIR, IMAGES_DIR)
-        # Create images directory if it doesn't exist
-        if not os.path.exists(images_fs_path):
-            os.makedirs(images_fs_path)
-
-        # Download images and update src to local path
-        for img in content_element.find_all('img', src=True):
-            img_url = urljoin(url, img['src'])
-            
-            # Generate unique filename based on hash of URL
-            img_hash = hashlib.md5(img_url.encode('utf-8')).hexdigest()
-            path_parts = os.path.splitext(urlparse(img_url).path)
-            ext = path_parts[1] if path_parts[1] else ".png"
-            # Sanitize extension
-            ext = re.sub(r'[^a-zA-Z0-9.]', '', ext)
-            img_filename = f"{img_hash}{ext}"
-            img_fs_path = os.path.join(images_fs_path, img_filename)
-            img_rel_path = os.path.join(IMAGES_DIR, img_filename)
-
-            # Download image if not already present
-            if not os.path.exists(img_fs_path):
-                try:
-                    print(f"Downloading image: {img_url}")
-                    r = session.get(img_url, stream=True, timeout=TIMEOUT)
-                    if r.status_code == 200:
-                        with open(img_fs_path, 'wb') as f:
-                            for chunk in r.iter_content(1024):
-                                f.write(chunk)
-                except Exception as e:
-                    print(f"Error downloading image {img_url}: {e}")
-            
-            # Update src to point to local file
-            img['src'] = img_rel_path
+        localize_images(page_url or url, content_element)
 
         # Get a title for the filename
         title_tag = soup.find('title')
@@ -131,9 +268,9 @@ def get_markdown_content(url, html_content):
         h = html2text.HTML2Text()
         h.body_width = 0  # Disable line wrapping
 
-        # Remove zero-width space characters (U+200B) that render as 'â<80><8b>'
-        # Also remove the mojibake sequence if encoding was guessed incorrectly
-        cleaned_html = str(content_element).replace('\u200b', '').replace('\u00e2\u0080\u008b', '')
+        # Remove zero-width space characters (U+200B) that render as 'â<80><8b>'.
+        # Pages are always decoded as UTF-8, so the mojibake form of it can't occur.
+        cleaned_html = str(content_element).replace('\u200b', '')
         markdown_content = h.handle(cleaned_html)
         
         # Add the original URL and title to the top
@@ -143,74 +280,192 @@ def get_markdown_content(url, html_content):
         print(f"An error occurred while processing {url}: {e}")
         return None
 
-def scrape_docs():
+def resolve_links(url, soup):
+    """Makes every link on the page absolute and returns them.
+
+    Covers the whole page (not just the content area), so navigation links are crawled too.
+    """
+    outlinks = []
+    for a in soup.find_all('a', href=True):
+        try:
+            a['href'] = urljoin(url, a['href'])
+        except ValueError:
+            # Malformed hrefs (e.g. a broken IPv6 host) can't be resolved or crawled
+            continue
+        outlinks.append(a['href'])
+    return outlinks
+
+def process_page(url, page_url, html_content):
+    """Converts a fetched page to markdown and collects its internal links.
+
+    Relative links are resolved against 'page_url', the URL the page was served from after
+    any redirects (e.g. 'guide' -> 'guide/').
+    """
+    soup = BeautifulSoup(html_content, 'lxml', from_encoding='utf-8') # Force UTF-8 encoding
+    # Resolve links first, so they work in the offline doc and the page doesn't need a second
+    # pass to find links to crawl. They are kept even if the conversion below fails.
+    outlinks = resolve_links(page_url, soup)
+    content_data = get_markdown_content(url, soup, page_url)
+
+    # Clean the links for comparison (remove fragments) and keep only those worth visiting
+    links = [link for link in map(canonicalize, outlinks) if is_internal_link(link)]
+    return content_data, links
+
+async def wait_for_host(host):
+    """Waits until DELAY has passed since the last request to 'host' was started."""
+    # Reserve the next slot before sleeping, so concurrent workers queue up behind each other
+    now = time.monotonic()
+    start = max(now, host_next_request.get(host, 0))
+    host_next_request[host] = start + DELAY
+    if start > now:
+        await asyncio.sleep(start - now)
+
+async def fetch(client, url):
+    """Fetches 'url' and returns the final URL after redirects and the raw response body."""
+    host = urlsplit(url).netloc
+    if host not in host_semaphores:
+        host_semaphores[host] = asyncio.Semaphore(CONCURRENCY_PER_HOST)
+
+    # Be polite to the server by capping and spacing out requests to the same host
+    async with host_semaphores[host]:
+        await wait_for_host(host)
+        response = await client.get(url)
+    response.raise_for_status() # Raise HTTPStatusError for bad responses (4xx or 5xx)
+    # Leave decoding to the parser rather than building a second copy as str
+    return str(response.url), response.content
+
+class PageWriter:
+    """Streams finished pages to a file in the order they were discovered."""
+
+    def __init__(self, f):
+        self.f = f
+        self.issued = 0
+        self.next_order = 1
+        self.pending = {}
+        self.toc_entries = []
+
+    def reserve(self):
+        """Returns the order number for the next page queued for crawling."""
+        self.issued += 1
+        return self.issued
+
+    def add(self, order, content_data):
+        """Records the result for page 'order' (None if it failed) and writes whatever is ready."""
+        self.pending[order] = content_data
+        # Pages finish out of order, so hold each one until those found before it are written
+        while self.next_order in self.pending:
+            content_data = self.pending.pop(self.next_order)
+            self.next_order += 1
+            if content_data:
+                content, title = content_data
+                if self.toc_entries:
+                    self.f.write("\n")
+                self.f.write(content)
+                self.toc_entries.append(title)
+
+async def worker(client, url_queue, writer):
+    """Takes URLs off the URL queue and processes them until cancelled."""
+    while True:
+        order, url = await url_queue.get()
+        content_data = None
+        try:
+            print(f"Processing link: {url}")
+            page_url, html_content = await fetch(client, url)
+
+            # A redirect may land on a page that is queued separately (e.g. 'guide' and 'guide/')
+            final_url = canonicalize(page_url)
+            if final_url != url:
+                key = url_key(final_url)
+                if key in visited_urls:
+                    print(f"Skipping {url}: redirects to {final_url}, which is already queued")
+                    continue
+                visited_urls.add(key)
+
+            # Parsing and image downloads block, so run them off the event loop
+            content_data, links = await asyncio.to_thread(process_page, url, page_url, html_content)
+
+            for link in links:
+                key = url_key(link)
+                if key not in visited_urls:
+                    visited_urls.add(key)
+                    url_queue.put_nowait((writer.reserve(), link))
+
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            print(f"Error fetching {url}: {e}")
+        except Exception as e:
+            # A bad page must never take a worker down, or the crawl stalls
+            print(f"An error occurred while processing {url}: {e}")
+        finally:
+            try:
+                # Unlike a bad page, a failed write to the output is fatal; it is raised out of
+                # the worker and scrape_docs aborts the crawl
+                writer.add(order, content_data)
+            finally:
+                url_queue.task_done()
+
+async def scrape_docs():
     """Main scraping loop."""
     print(f"Starting crawl of {BASE_URL}")
     print(f"Output directory: {OUTPUT_DIR}")
     print(f"Output file: {OUTPUT_FILE}\n")
-    
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
 
-    all_markdown_content = []
-    toc_entries = []
-    
-    while urls_to_visit:
-        url = urls_to_visit.pop(0)
-        
-        # Clean the URL to ignore fragments (like #section-anchor)
-        base_url_only = urljoin(url, urlparse(url).path)
-        
-        if base_url_only in visited_urls:
-            continue
-        
-        print(f"Processing link: {base_url_only}")
-        visited_urls.add(base_url_only)
-        
-        try:
-            # Use a User-Agent to mimic a browser
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-            response = session.get(url, headers=headers, timeout=TIMEOUT)
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            response.encoding = 'utf-8' # Force UTF-8 encoding
-            
-            # Save the current page content
-            content_data = get_markdown_content(base_url_only, response.text)
-            if content_data:
-                content, title = content_data
-                all_markdown_content.append(content)
-                toc_entries.append(title)
-            
-            # Find new internal links to visit
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for link in soup.find_all('a', href=True):
-                href = link.get('href')
-                
-                # Resolve relative URLs
-                full_url = urljoin(BASE_URL, href)
-                
-                # Clean the URL for comparison (remove fragments)
-                full_url_base = urljoin(full_url, urlparse(full_url).path)
-
-                if is_internal_link(full_url_base) and full_url_base not in visited_urls:
-                    if full_url_base not in urls_to_visit:
-                        urls_to_visit.append(full_url_base)
-                    
-            # Be polite to the server by waiting briefly between requests
-            time.sleep(DELAY) 
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching {base_url_only}: {e}")
-            
+    # Create images directory if it doesn't exist, and note which images a previous
+    # run already downloaded so pages don't need to check for each one on disk
+    images_fs_path = os.path.join(OUTPUT_DIR, IMAGES_DIR)
+    os.makedirs(images_fs_path, exist_ok=True)
+    existing_images.update(os.listdir(images_fs_path))
+
+    url_queue = asyncio.Queue()
+
+    # Pages are written as they finish; the table of contents is prepended at the end
+    output_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
+    body_path = output_path + ".part"
+    with open(body_path, "w", encoding="utf-8", buffering=1 << 20) as body:
+        writer = PageWriter(body)
+
+        for url in urls_to_visit:
+            base_url_only = canonicalize(url)
+            key = url_key(base_url_only)
+            if key not in visited_urls:
+                visited_urls.add(key)
+                url_queue.put_nowait((writer.reserve(), base_url_only))
+
+        # Use a User-Agent to mimic a browser. Over HTTP/2 all pages from the docs host
+        # share one multiplexed connection; the limits only matter for HTTP/1.1 servers.
+        headers = {'User-Agent': USER_AGENT}
+        limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+        async with httpx.AsyncClient(http2=True, timeout=TIMEOUT, headers=headers, limits=limits, follow_redirects=True) as client:
+            workers = [asyncio.create_task(worker(client, url_queue, writer)) for _ in range(CONCURRENCY)]
+            # Workers only stop on their own if writing the output failed, so watch them too
+            # rather than waiting on the queue forever
+            finished = asyncio.create_task(url_queue.join())
+            await asyncio.wait([finished, *workers], return_when=asyncio.FIRST_COMPLETED)
+            for task in [finished, *workers]:
+                task.cancel()
+            for result in await asyncio.gather(*workers, return_exceptions=True):
+                if isinstance(result, Exception):
+                    raise result
+
     # Generate Table of Contents
     toc_lines = ["# Table of Contents\n"]
-    for title in toc_entries:
-        slug = re.sub(r'[^\w\s-]', '', title.lower()).strip().replace(' ', '-')
+    for title in writer.toc_entries:
+        slug = SLUG_RE.sub('', title.lower()).strip().replace(' ', '-')
         toc_lines.append(f"* [{title}](#{slug})")
 
-    output_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(toc_lines) + "\n\n---\n\n" + "\n".join(all_markdown_content))
+    with open(output_path, "w", encoding="utf-8") as f, open(body_path, encoding="utf-8") as body:
+        f.write("\n".join(toc_lines) + "\n\n---\n\n")
+        shutil.copyfileobj(body, f, 1 << 20)
+    os.remove(body_path)
+
+def positive_int(value):
+    """argparse type for options that must be at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a whole number, got {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Scrape documentation sites to Markdown.")
@@ -222,11 +477,15 @@ if __name__ == "__main__":
     parser.add_argument("--run-name", help="Custom name for the output subdirectory (overrides timestamp)")
     parser.add_argument("--append-to-timestamp", action="store_true", help="Append run-name to timestamp instead of replacing it")
     parser.add_argument("--timeout", type=int, default=TIMEOUT, help="Request timeout in seconds")
-    parser.add_argument("--delay", type=float, default=DELAY, help="Delay between requests in seconds")
+    parser.add_argument("--delay", type=float, default=DELAY, help="Delay between requests to the same host in seconds")
+    parser.add_argument("--bloom-filter", action="store_true", help="Track visited URLs in a fixed-size Bloom filter to save memory on very large sites (may skip a few pages)")
+    parser.add_argument("--concurrency", type=positive_int, default=CONCURRENCY, help="Maximum number of pages fetched in parallel")
+    parser.add_argument("--concurrency-per-host", type=positive_int, default=CONCURRENCY_PER_HOST, help="Maximum number of pages fetched in parallel from one host")
     
     args = parser.parse_args()
     
     BASE_URL = args.url
+    BASE_NETLOC = urlsplit(BASE_URL).netloc
     CONTENT_SELECTOR = args.selector
     
     if args.run_name:
@@ -242,10 +501,19 @@ if __name__ == "__main__":
     IMAGES_DIR = args.images_dir
     TIMEOUT = args.timeout
     DELAY = args.delay
-    
+    CONCURRENCY = args.concurrency
+    CONCURRENCY_PER_HOST = args.concurrency_per_host
+
+    if args.bloom_filter:
+        visited_urls = BloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE)
+
     # Reset urls_to_visit with the (possibly new) BASE_URL
     urls_to_visit = [BASE_URL]
 
-    scrape_docs()
+    threading.Thread(target=image_writer, daemon=True).start()
+    asyncio.run(scrape_docs())
+    image_executor.shutdown()
+    # Wait for the last images to reach the disk
+    image_write_queue.join()
     print("\n--- Download complete ---")
     print(f"Documentation saved to '{OUTPUT_FILE}'.")
\ No newline at end of file